@@ -13,12 +13,63 @@ import argparse
 import subprocess
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
-from collections import defaultdict
+from collections import defaultdict, deque
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+
+class InterningLoader(YamlLoader):
+    """YAML loader that interns string scalars so repeated keys share one object."""
+
+
+def _construct_interned_str(loader: YamlLoader, node: yaml.ScalarNode) -> str:
+    return sys.intern(loader.construct_scalar(node))
+
+
+InterningLoader.add_constructor("tag:yaml.org,2002:str", _construct_interned_str)
+
+try:
+    import orjson
+
+    def _dumps(obj: Any, indent: bool = False) -> bytes:
+        """Serialize obj to JSON bytes using orjson."""
+        # YAML may yield bool/int keys (e.g. "on:"); stringify them like json does
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+
+except ImportError:
+
+    def _dumps(obj: Any, indent: bool = False) -> bytes:
+        """Serialize obj to JSON bytes using the stdlib json module."""
+        if indent:
+            return json.dumps(obj, indent=2).encode()
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+
+BRANCH_PLACEHOLDER = "BRANCH_PLACEHOLDER"
+
+# Runner matrix shared by every level file
+OS_MATRIX = [
+    {"arch": "arm64", "runner": "ubuntu-24.04-arm"},
+    {"arch": "amd64", "runner": "ubuntu-latest"},
+]
+
+# Number of level files written to the output directory (level_0 .. level_3)
+MAX_LEVELS = 4
 
 
 def replace_branch_placeholder(obj: Any, branch_name: str) -> Any:
     """
-    Recursively replace BRANCH_PLACEHOLDER with the actual branch name in any data structure.
+    Replace BRANCH_PLACEHOLDER with the actual branch name in any data structure.
+
+    Dicts and lists are walked iteratively and updated in place; only strings
+    that contain the placeholder are rewritten. Each container is visited once,
+    so shared or cyclic YAML aliases are handled safely.
 
     Args:
         obj: The object to process (dict, list, str, or other)
@@ -27,14 +78,31 @@ def replace_branch_placeholder(obj: Any, branch_name: str) -> Any:
     Returns:
         The object with all BRANCH_PLACEHOLDER occurrences replaced
     """
-    if isinstance(obj, dict):
-        return {k: replace_branch_placeholder(v, branch_name) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [replace_branch_placeholder(item, branch_name) for item in obj]
-    elif isinstance(obj, str):
-        return obj.replace("BRANCH_PLACEHOLDER", branch_name)
-    else:
-        return obj
+    if isinstance(obj, str):
+        return obj.replace(BRANCH_PLACEHOLDER, branch_name)
+
+    stack = [obj]
+    seen = set()
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        if isinstance(current, dict):
+            items = current.items()
+        elif isinstance(current, list):
+            items = enumerate(current)
+        else:
+            continue
+        seen.add(id(current))
+
+        for key, value in items:
+            if isinstance(value, str):
+                if BRANCH_PLACEHOLDER in value:
+                    current[key] = value.replace(BRANCH_PLACEHOLDER, branch_name)
+            else:
+                stack.append(value)
+
+    return obj
 
 
 def parse_overrides(overrides_json: str) -> Dict[str, str]:
@@ -251,64 +319,65 @@ def organize_by_levels(
 
     Returns:
         List of lists, where each inner list contains jobs at that dependency level
+
+    Raises:
+        ValueError: If a job is its own ancestor (e.g. via a cyclic YAML alias)
     """
     levels = defaultdict(list)
 
-    def find_and_process_matching_jobs(
-        job: Dict[str, Any],
-        level: int,
-        parent_image: Optional[str] = None,
-        include: bool = False,
-    ) -> bool:
-        """
-        Recursively search for jobs matching the repo filter and process them.
-
-        Args:
-            job: The job to process
-            level: Current dependency level
-            parent_image: Parent image for base_image field
-            include: Whether this job should be included (parent was matched)
-
-        Returns:
-            True if this job or any descendant matches the filter
-        """
+    # Walk the job tree breadth-first. Each queue entry carries the job, its
+    # dependency level, the base_image derived from its parent, whether it
+    # should be included because an ancestor matched the repo filter, and the
+    # ids of its ancestors so dependency cycles can be detected.
+    queue = deque((job, 0, None, False, frozenset()) for job in config_items)
+    while queue:
+        job, level, base_image, include, ancestors = queue.popleft()
+
+        if id(job) in ancestors:
+            raise ValueError(
+                f"Dependency cycle detected at job "
+                f"{job.get('repo', 'unknown')} -> {job.get('image', 'unknown')}"
+            )
+
         # Check if this job matches the filter
         matches = repo_filter is None or job.get("repo") == repo_filter
 
-        # Check if any dependent jobs match (look ahead)
-        has_matching_descendant = False
-        if "dependent_jobs" in job:
-            for dependent_job in job["dependent_jobs"]:
-                if find_and_process_matching_jobs(
-                    dependent_job, level + 1, job.get("image"), include or matches
-                ):
-                    has_matching_descendant = True
-
         # Include this job if it matches or we're already including (parent matched)
         # Don't include just because of matching descendants
         if matches or include:
-            job_copy = {k: v for k, v in job.items() if k != "dependent_jobs"}
+            job_copy = dict(job)
+            job_copy.pop("dependent_jobs", None)
 
             # Add base_image field for dependent jobs
-            if parent_image:
-                parent_image = parent_image.replace("/", "_")
-                if base_image_tag:
-                    job_copy["base_image"] = f"{parent_image}--{base_image_tag}"
-                else:
-                    job_copy["base_image"] = parent_image
+            if base_image:
+                job_copy["base_image"] = base_image
 
             # Apply ref override if this repo has one
             if ref_overrides and job_copy.get("repo") in ref_overrides:
                 job_copy["ref"] = ref_overrides[job_copy["repo"]]
 
             levels[level].append(job_copy)
-            return True
 
-        return has_matching_descendant
-
-    # Process all top-level jobs
-    for job in config_items:
-        find_and_process_matching_jobs(job, 0)
+        # Queue dependent jobs; they are included once this job or an ancestor matched
+        # The base_image is computed once here and shared by all siblings
+        if "dependent_jobs" in job:
+            child_base_image = None
+            image = job.get("image")
+            if image:
+                child_base_image = image.replace("/", "_")
+                if base_image_tag:
+                    child_base_image = f"{child_base_image}--{base_image_tag}"
+            child_ancestors = ancestors | {id(job)}
+            for dependent_job in job["dependent_jobs"]:
+                queue.append(
+                    (
+                        dependent_job,
+                        level + 1,
+                        child_base_image,
+                        include or matches,
+                        child_ancestors,
+                    )
+                )
 
     # Convert defaultdict to sorted list of lists
     max_level = max(levels.keys()) if levels else 0
@@ -347,20 +416,45 @@ def main():
         '(e.g., "shawn-hurley/analyzer-lsp:my-feature"). Used to generate '
         "go_mod_replaces for overridden images that depend on the tested repo.",
     )
+    parser.add_argument(
+        "--only-level",
+        type=int,
+        help=f"Only write level_<N>.json (0-{MAX_LEVELS - 1}) to the output "
+        "directory and skip the other level files and all_levels.json. "
+        "Requires output_dir.",
+    )
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Indent the JSON files written to the output directory. "
+        "By default they are written compactly.",
+    )
 
     args = parser.parse_args()
 
+    if args.only_level is not None:
+        if not 0 <= args.only_level < MAX_LEVELS:
+            parser.error(f"--only-level must be between 0 and {MAX_LEVELS - 1}")
+        if not args.output_dir:
+            parser.error("--only-level requires output_dir")
+
+    if YamlLoader is yaml.SafeLoader:
+        print(
+            "Warning: libyaml not available, falling back to the pure-Python YAML parser",
+            file=sys.stderr,
+        )
+
     try:
         # Read and parse the YAML file
-        with open(args.yaml_file, "r") as f:
-            data = yaml.safe_load(f)
+        raw = Path(args.yaml_file).read_text()
+        data = yaml.load(raw, Loader=InterningLoader)
 
         if "config" not in data:
             print("Error: YAML file must contain a 'config' key", file=sys.stderr)
             sys.exit(1)
 
-        # Replace BRANCH_PLACEHOLDER if branch is specified
-        if args.branch:
+        # Replace BRANCH_PLACEHOLDER if branch is specified and the file uses it
+        if args.branch and BRANCH_PLACEHOLDER in raw:
             data = replace_branch_placeholder(data, args.branch)
 
         # Parse ref overrides from CI comments
@@ -395,31 +489,33 @@ def main():
 
             # Always write 4 level files (0-3) even if some are empty
             # This ensures workflows can always read all expected files
-            max_levels = 4
-            for level_idx in range(max_levels):
+            # Only the requested level is written when --only-level is given
+            if args.only_level is not None:
+                level_indices = [args.only_level]
+            else:
+                level_indices = range(MAX_LEVELS)
+            for level_idx in level_indices:
                 output_file = output_path / f"level_{level_idx}.json"
                 # Get jobs for this level, or empty list if level doesn't exist
                 jobs = levels[level_idx] if level_idx < len(levels) else []
-                with open(output_file, "w") as f:
-                    output = {
-                        "image": jobs,
-                        "os": [
-                            {"arch": "arm64", "runner": "ubuntu-24.04-arm"},
-                            {"arch": "amd64", "runner": "ubuntu-latest"},
-                        ],
-                    }
-                    json.dump(output, f, indent=2)
+                with open(output_file, "wb") as f:
+                    output = {"image": jobs, "os": OS_MATRIX}
+                    f.write(_dumps(output, indent=args.pretty))
                 print(f"Wrote {len(jobs)} jobs to {output_file}")
 
             # Also write all levels combined
-            all_levels_file = output_path / "all_levels.json"
-            with open(all_levels_file, "w") as f:
-                json.dump(levels, f, indent=2)
-            print(f"\nWrote all levels to {all_levels_file}")
+            if args.only_level is None:
+                all_levels_file = output_path / "all_levels.json"
+                with open(all_levels_file, "wb") as f:
+                    f.write(_dumps(levels, indent=args.pretty))
+                print(f"\nWrote all levels to {all_levels_file}")
         else:
             # Output all levels as JSON to stdout
             print("\nJSON Output:")
-            print(json.dumps(levels, indent=2))
+            # Write the encoded bytes directly instead of decoding back to str
+            sys.stdout.flush()
+            sys.stdout.buffer.write(_dumps(levels, indent=True) + b"\n")
+            sys.stdout.buffer.flush()
 
     except FileNotFoundError:
         print(f"Error: File '{args.yaml_file}' not found", file=sys.stderr)